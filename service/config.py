@@ -21,6 +21,10 @@ class AppSettings(BaseSettings):
     mailtrap_api_token: str 
     superuser_phone: str
     honeybadger_api_key: str
+    socket_backplane: str = "memory" # memory | broker
+    socket_broker_url: str = "tcp://127.0.0.1:9100" # tcp://host:port or unix:///path/to/broker.sock
+    socket_queue_size: int = 256 # per connection outbound queue, a client that fills it is disconnected
+    socket_ephemeral_watermark: int = 32 # typing/reading/away/thinking events are dropped past this queue depth
 
     model_config = {
         "env_file": "../.env",
@@ -28,5 +28,10 @@ python -m alembic upgrade head
 echo "----------INITIALIZE DATABASE------------------"
 python init.py
 
+if [ "$SOCKET_BACKPLANE" = "broker" ]; then
+    echo "----------STARTING SOCKET BROKER------------------"
+    python -m sockets.backplane &
+fi
+
 echo "------STARTING GUNICORN AT 0.0.0.0:${SERVICE_PORT}--"
 uvicorn main:app --host 0.0.0.0 --port "$SERVICE_PORT" --workers 4 --reload
\ No newline at end of file
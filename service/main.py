@@ -1,10 +1,11 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 import uvicorn
 from api import auth,chat
 from honeybadger import honeybadger
 from config import settings
-from sockets.chat_socket import chatsocket_wrapper
+from sockets.chat_socket import chatsocket_wrapper, manager
 
 
 fastapi_config = {
@@ -13,8 +14,14 @@ fastapi_config = {
     "root_path": "/api",
 }
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await manager.start()
+    yield
+    await manager.stop()
+
 honeybadger.configure(api_key=settings.honeybadger_api_key,environment="production",report_data=True)
-app = FastAPI(**fastapi_config)
+app = FastAPI(**fastapi_config, lifespan=lifespan)
 app.include_router(auth.router,prefix="/auth")
 app.include_router(chat.router,prefix="/chat")
 app.add_api_websocket_route("/chatsocket/{room_id}",chatsocket_wrapper)
@@ -0,0 +1,240 @@
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, Optional, Set
+from urllib.parse import urlparse
+from config import logger, settings
+
+"""
+    Pub/sub backplanes used by the ConnectionManager to fan room events out across uvicorn workers.
+    Every worker publishes a room event once, the backplane hands it to every worker that has sockets
+    in that room and each worker delivers it to its own local sockets only.
+"""
+
+Deliver = Callable[[str, dict], Awaitable[None]]
+FRAME_LIMIT = 2**20 # largest newline delimited frame accepted from the broker
+
+
+class Backplane:
+    """
+        Base backplane, a worker subscribes to the rooms it holds sockets for and publishes room events
+    """
+    def __init__(self):
+        self.deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+
+    async def stop(self):
+        self.deliver = None
+
+    async def subscribe(self, room: str):
+        raise NotImplementedError
+
+    async def unsubscribe(self, room: str):
+        raise NotImplementedError
+
+    async def publish(self, room: str, payload: dict):
+        raise NotImplementedError
+
+
+class InProcessHub:
+    """
+        Routing table shared by InProcessBackplanes living in the same process
+    """
+    def __init__(self):
+        self.rooms: Dict[str, Set["InProcessBackplane"]] = {}
+
+
+class InProcessBackplane(Backplane):
+    """
+        Backplane for a single worker, or for several managers sharing one hub (tests)
+    """
+    def __init__(self, hub: Optional[InProcessHub] = None):
+        super().__init__()
+        self.hub = hub or InProcessHub()
+
+    async def stop(self):
+        for subscribers in self.hub.rooms.values():
+            subscribers.discard(self)
+        await super().stop()
+
+    async def subscribe(self, room: str):
+        self.hub.rooms.setdefault(room, set()).add(self)
+
+    async def unsubscribe(self, room: str):
+        subscribers = self.hub.rooms.get(room)
+        if subscribers is None:
+            return
+        subscribers.discard(self)
+        if not subscribers:
+            del self.hub.rooms[room]
+
+    async def publish(self, room: str, payload: dict):
+        for backplane in list(self.hub.rooms.get(room, ())):
+            if backplane.deliver:
+                await backplane.deliver(room, payload)
+
+
+async def open_broker_connection(url: str):
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return await asyncio.open_unix_connection(parsed.path, limit=FRAME_LIMIT)
+    elif parsed.scheme == "tcp":
+        return await asyncio.open_connection(parsed.hostname, parsed.port, limit=FRAME_LIMIT)
+    raise ValueError(f"Unsupported broker url: {url}")
+
+
+class BrokerBackplane(Backplane):
+    """
+        Backplane talking to a local broker process (see run_broker) over loopback TCP or a unix socket.
+        Frames are newline delimited json: {"op": "sub"|"unsub"|"pub", "room": str, "payload": dict}.
+        The publishing worker delivers to its own sockets directly, the broker relays to the other workers.
+    """
+    def __init__(self, url: str, reconnect_delay: float = 0.5, connect_timeout: float = 5.0):
+        super().__init__()
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.connect_timeout = connect_timeout
+        self.rooms: Set[str] = set()
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task] = None
+        self.connected = asyncio.Event()
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        self.reader_task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self.connected.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Broker {self.url} unreachable, room events stay local until it comes up")
+
+    async def stop(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+            try:
+                await self.reader_task
+            except asyncio.CancelledError:
+                pass
+            self.reader_task = None
+        self._close()
+        await super().stop()
+
+    async def subscribe(self, room: str):
+        if room not in self.rooms:
+            self.rooms.add(room)
+            await self._send({"op": "sub", "room": room})
+
+    async def unsubscribe(self, room: str):
+        if room in self.rooms:
+            self.rooms.discard(room)
+            await self._send({"op": "unsub", "room": room})
+
+    async def publish(self, room: str, payload: dict):
+        if self.deliver and room in self.rooms:
+            await self.deliver(room, payload)
+        await self._send({"op": "pub", "room": room, "payload": payload})
+
+    async def _send(self, frame: dict):
+        if not self.writer:
+            logger.error(f"Broker {self.url} is not connected, dropping {frame['op']} for room {frame['room']}")
+            return
+        try:
+            self.writer.write(json.dumps(frame).encode() + b"\n")
+            await self.writer.drain()
+        except (ConnectionError, RuntimeError) as e:
+            logger.error(f"Failed to write to broker {self.url}: {e}")
+            self._close()
+
+    def _close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader, self.writer = None, None
+        self.connected.clear()
+
+    async def _run(self):
+        while True:
+            try:
+                self.reader, self.writer = await open_broker_connection(self.url)
+                # resubscribe after a (re)connect so the broker knows our rooms
+                for room in self.rooms:
+                    self.writer.write(json.dumps({"op": "sub", "room": room}).encode() + b"\n")
+                await self.writer.drain()
+                self.connected.set()
+                logger.info(f"Connected to broker {self.url}")
+                while line := await self.reader.readline():
+                    frame = json.loads(line)
+                    if self.deliver and frame["room"] in self.rooms:
+                        await self.deliver(frame["room"], frame["payload"])
+                logger.error(f"Broker {self.url} closed the connection")
+            except (OSError, ValueError) as e:
+                logger.error(f"Broker {self.url} connection error: {e}")
+            self._close()
+            await asyncio.sleep(self.reconnect_delay)
+
+
+class Broker:
+    """
+        Relays published frames to every other connection subscribed to the room
+    """
+    def __init__(self):
+        self.rooms: Dict[str, Set[asyncio.StreamWriter]] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: Set[str] = set()
+        try:
+            while line := await reader.readline():
+                frame = json.loads(line)
+                room = frame["room"]
+                match frame["op"]:
+                    case "sub":
+                        self.rooms.setdefault(room, set()).add(writer)
+                        subscribed.add(room)
+                    case "unsub":
+                        self._unsubscribe(room, writer)
+                        subscribed.discard(room)
+                    case "pub":
+                        for subscriber in list(self.rooms.get(room, ())):
+                            if subscriber is not writer:
+                                subscriber.write(line)
+        except (ConnectionError, ValueError) as e:
+            logger.error(f"Broker client error: {e}")
+        finally:
+            for room in subscribed:
+                self._unsubscribe(room, writer)
+            writer.close()
+
+    def _unsubscribe(self, room: str, writer: asyncio.StreamWriter):
+        subscribers = self.rooms.get(room)
+        if subscribers is None:
+            return
+        subscribers.discard(writer)
+        if not subscribers:
+            del self.rooms[room]
+
+
+async def start_broker(url: str) -> asyncio.AbstractServer:
+    broker = Broker()
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return await asyncio.start_unix_server(broker.handle, path=parsed.path, limit=FRAME_LIMIT)
+    elif parsed.scheme == "tcp":
+        return await asyncio.start_server(broker.handle, parsed.hostname, parsed.port, limit=FRAME_LIMIT)
+    raise ValueError(f"Unsupported broker url: {url}")
+
+
+async def run_broker(url: str):
+    server = await start_broker(url)
+    logger.info(f"Socket broker listening on {url}")
+    async with server:
+        await server.serve_forever()
+
+
+def get_backplane() -> Backplane:
+    if settings.socket_backplane == "broker":
+        return BrokerBackplane(settings.socket_broker_url)
+    return InProcessBackplane()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_broker(settings.socket_broker_url))
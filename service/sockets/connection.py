@@ -0,0 +1,96 @@
+import asyncio
+from typing import Optional
+from fastapi import WebSocket, status
+from config import logger, settings
+import schemas
+
+# presence style events a client can afford to miss, the next one supersedes them anyway
+EPHEMERAL_TYPES = {
+    schemas.MessageType.READING.value,
+    schemas.MessageType.AWAY.value,
+    schemas.MessageType.TYPING.value,
+    schemas.MessageType.THINKING.value,
+}
+
+
+class Connection:
+    """
+        A websocket with its own bounded outbound queue drained by a writer task, so a stalled client
+        only ever delays itself. Slow consumer policy:
+            - ephemeral events are dropped once the queue is deeper than ephemeral_watermark
+            - any event that finds the queue full (the high-water mark) disconnects the client,
+              it has to reconnect and catch up instead of holding server memory
+    """
+    def __init__(self, websocket: WebSocket, user_id: str, max_queue: Optional[int] = None, ephemeral_watermark: Optional[int] = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue or settings.socket_queue_size)
+        self.ephemeral_watermark = ephemeral_watermark or settings.socket_ephemeral_watermark
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self.too_slow = False
+        self.writer_task = asyncio.create_task(self._write())
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def send(self, payload: dict) -> bool:
+        """
+            Enqueue a payload without blocking, returns False when the payload was dropped
+        """
+        if self.closed:
+            return False
+        if payload.get("type") in EPHEMERAL_TYPES and self.queue.qsize() >= self.ephemeral_watermark:
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.too_slow = True
+            self.closed = True
+            logger.error(f"User {self.user_id} is not keeping up, {self.queue.qsize()} events queued, disconnecting")
+            asyncio.create_task(self.close(code=status.WS_1013_TRY_AGAIN_LATER))
+            return False
+
+    async def drain(self):
+        """
+            Wait until everything queued so far has been written
+        """
+        await self.queue.join()
+
+    async def stop(self):
+        """
+            Stop the writer, used once the client has gone away
+        """
+        self.closed = True
+        if self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        await self.stop()
+        try:
+            await self.websocket.close(code=code)
+        except Exception as e:
+            logger.error(f"Failed to close socket for {self.user_id}: {e}")
+
+    async def _write(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                if not self.closed:
+                    await self.websocket.send_json(payload)
+                    self.sent += 1
+            except Exception as e:
+                # the socket is gone, the receive loop will notice and detach us
+                logger.error(f"Failed to send message to {self.user_id}: {e}")
+                self.closed = True
+            finally:
+                self.queue.task_done()
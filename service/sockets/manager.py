@@ -1,28 +1,63 @@
+from typing import Optional
 from fastapi import WebSocket
 from config import logger
 import datetime
 import models
 import schemas
 import uuid
+from .backplane import Backplane, get_backplane
+from .connection import Connection
 
 class ConnectionManager:
-    
-    def __init__(self):
+
+    def __init__(self, backplane: Optional[Backplane] = None):
         """
         {
             "room_id": {
-                "user_id": websocket
+                "user_id": connection
             }
         }
+        rooms only holds this worker's sockets, events for other workers go through the backplane
         """
-        self.rooms: dict[str, dict[dict[str,WebSocket]]] = {}
+        self.rooms: dict[str, dict[str,Connection]] = {}
+        self.backplane: Backplane = backplane or get_backplane()
+        self.started = False
+        self.dropped = 0 # drops of connections that are already gone
+        self.slow_disconnects = 0
+
+    async def start(self):
+        if not self.started:
+            self.started = True
+            await self.backplane.start(self.deliver)
+
+    async def stop(self):
+        if self.started:
+            self.started = False
+            await self.backplane.stop()
+
+    async def attach(self, websocket: WebSocket, room: str, user_id: str):
+        await self.start()
+        if room not in self.rooms:
+            self.rooms[room] = {}
+            await self.backplane.subscribe(room)
+        previous = self.rooms[room].get(user_id)
+        if previous:
+            await previous.stop()
+        self.rooms[room][user_id] = Connection(websocket, user_id)
+
+    async def detach(self, room: str, user_id: str):
+        connection = self.rooms.get(room, {}).pop(user_id, None)
+        if connection:
+            self.dropped += connection.dropped
+            await connection.stop()
+        if room in self.rooms and not self.rooms[room]:
+            del self.rooms[room]
+            await self.backplane.unsubscribe(room)
 
     async def connect(self, websocket: WebSocket, room: str, user: models.User, db: models.Session):
         logger.error(f"User {user.phone} has joined the chat")
         await websocket.accept()
-        if room not in self.rooms:
-            self.rooms[room] = {}
-        self.rooms[room][str(user.id)] = websocket
+        await self.attach(websocket, room, str(user.id))
         user.last_seen = datetime.datetime.now(tz=datetime.timezone.utc)
         db.commit()
         db.refresh(user)
@@ -35,18 +70,36 @@ class ConnectionManager:
         user.last_seen = datetime.datetime.now(tz=datetime.timezone.utc)
         db.commit()
         db.refresh(user)
-        self.rooms[room].pop(str(user.id))
-        if not self.rooms[room]:
-            del self.rooms[room]
+        await self.detach(room, str(user.id))
         user_dict = schemas.UserInDBBase.model_validate(user).model_dump()
         socket_message = schemas.SocketMessage(type=schemas.MessageType.OFFLINE, user=user_dict, id=uuid.uuid4())
-        await self.broadcast(socket_message, room) # always be broadcasting        
+        await self.broadcast(socket_message, room) # always be broadcasting
 
     async def broadcast(self, message: schemas.SocketMessage, room: str):
         logger.error(f"Broadcasting message {message.type} to room {room}")
-        for user_id, connection in list(self.rooms.get(room, {}).items()):
-            try:
-                logger.error(f"Broadcasting message {message.type} to room {room} user_id {user_id} and connection {connection}")
-                await connection.send_json(message.model_dump(mode="json"))
-            except Exception as e:
-                logger.error(f"Failed to send message to {user_id} in room {room}: {e}")
\ No newline at end of file
+        await self.start()
+        await self.backplane.publish(room, message.model_dump(mode="json"))
+
+    async def deliver(self, room: str, payload: dict):
+        """
+            Queue a room event coming off the backplane on every socket connected to this worker, never blocks
+        """
+        for connection in list(self.rooms.get(room, {}).values()):
+            was_closed = connection.closed
+            connection.send(payload)
+            if connection.too_slow and not was_closed:
+                self.slow_disconnects += 1
+
+    def stats(self) -> dict:
+        """
+            Outbound queue counters for this worker
+        """
+        connections = [c for room in self.rooms.values() for c in room.values()]
+        return {
+            "connections": len(connections),
+            "queued": sum(c.depth for c in connections),
+            "max_queue_depth": max((c.depth for c in connections), default=0),
+            "sent": sum(c.sent for c in connections),
+            "dropped": self.dropped + sum(c.dropped for c in connections),
+            "slow_disconnects": self.slow_disconnects,
+        }
@@ -1,9 +1,14 @@
+import asyncio
 from unittest.mock import patch
+import uuid
 import pytest
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 from .test_api import authenticate
 import models
+import schemas
+from sockets.backplane import BrokerBackplane, InProcessBackplane, InProcessHub, start_broker
+from sockets.manager import ConnectionManager
 from .conftest import test_settings
 
 
@@ -105,4 +110,106 @@ async def test_websockets(mock_send_sms,client,db: Session):
         socket.send_json(offline_status_socket_data)
         offline_status_alert_json = socket.receive_json()
         assert offline_status_alert_json["type"] == "offline"
-    
\ No newline at end of file
+    
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+class StalledWebSocket(FakeWebSocket):
+    def __init__(self):
+        super().__init__()
+        self.closed_with = None
+
+    async def send_json(self, data):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def socket_message(type=schemas.MessageType.TYPING):
+    return schemas.SocketMessage(id=uuid.uuid4(), type=type, user={"phone": test_settings.superuser_phone})
+
+async def drained(*managers: ConnectionManager):
+    for manager in managers:
+        for room in manager.rooms.values():
+            for connection in room.values():
+                await connection.drain()
+
+
+# test room events published on one worker reach sockets attached to another worker
+@pytest.mark.asyncio
+async def test_inprocess_backplane():
+    hub = InProcessHub()
+    worker1, worker2 = ConnectionManager(InProcessBackplane(hub)), ConnectionManager(InProcessBackplane(hub))
+    socket1, socket2, socket3 = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await worker1.attach(socket1, "room1", "user1")
+    await worker2.attach(socket2, "room1", "user2")
+    await worker2.attach(socket3, "room2", "user3")
+    await worker1.broadcast(socket_message(), "room1")
+    await drained(worker1, worker2)
+    assert len(socket1.sent) == 1 and len(socket2.sent) == 1
+    assert socket3.sent == []
+    await worker2.detach("room1", "user2")
+    assert worker2.backplane not in hub.rooms["room1"]
+    await worker1.broadcast(socket_message(), "room1")
+    await drained(worker1, worker2)
+    assert len(socket1.sent) == 2 and len(socket2.sent) == 1
+    await worker1.stop()
+    await worker2.stop()
+
+# test room events relayed between workers through a loopback broker
+@pytest.mark.asyncio
+async def test_broker_backplane():
+    server = await start_broker("tcp://127.0.0.1:0")
+    port = server.sockets[0].getsockname()[1]
+    worker1 = ConnectionManager(BrokerBackplane(f"tcp://127.0.0.1:{port}"))
+    worker2 = ConnectionManager(BrokerBackplane(f"tcp://127.0.0.1:{port}"))
+    socket1, socket2 = FakeWebSocket(), FakeWebSocket()
+    await worker1.attach(socket1, "room1", "user1")
+    await worker2.attach(socket2, "room1", "user2")
+    await asyncio.sleep(0.1)
+    await worker1.broadcast(socket_message(), "room1")
+    for _ in range(50):
+        if socket2.sent:
+            break
+        await asyncio.sleep(0.01)
+    await drained(worker1)
+    assert len(socket1.sent) == 1
+    assert len(socket2.sent) == 1 and socket2.sent[0]["type"] == "typing"
+    await worker1.stop()
+    await worker2.stop()
+    server.close()
+    await server.wait_closed()
+
+# test a stalled socket neither blocks the room nor grows without bound
+@pytest.mark.asyncio
+async def test_slow_consumer():
+    manager = ConnectionManager(InProcessBackplane())
+    fast, stalled = FakeWebSocket(), StalledWebSocket()
+    await manager.attach(fast, "room1", "fast")
+    await manager.attach(stalled, "room1", "stalled")
+    stalled_connection = manager.rooms["room1"]["stalled"]
+    stalled_connection.queue = asyncio.Queue(maxsize=4)
+    stalled_connection.ephemeral_watermark = 2
+    for _ in range(3):
+        await manager.broadcast(socket_message(schemas.MessageType.TYPING), "room1")
+    await asyncio.sleep(0)
+    assert stalled_connection.dropped >= 1
+    for _ in range(5):
+        await manager.broadcast(socket_message(schemas.MessageType.CHAT), "room1")
+    await manager.rooms["room1"]["fast"].drain()
+    await asyncio.sleep(0.01)
+    assert len(fast.sent) == 8
+    assert stalled_connection.closed and stalled.closed_with == 1013
+    stats = manager.stats()
+    assert stats["slow_disconnects"] == 1 and stats["dropped"] >= 2
+    await manager.stop()